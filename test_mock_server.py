@@ -11,16 +11,37 @@ Usage: python3 test_mock_server.py
 
 import asyncio
 import json
+import logging
+import os
 import time
 import random
-import uuid
+import secrets
+from dataclasses import dataclass, field
 
 try:
     import websockets
 except ImportError:
-    print("Install websockets: pip3 install websockets")
+    print("Install websockets: pip3 install 'websockets>=14'")
     exit(1)
 
+# Per-message logging is off unless MOCK_VERBOSE is set; the format work is
+# skipped entirely when disabled.
+_LOG = logging.getLogger("mock")
+_LOG.setLevel(logging.INFO if os.getenv("MOCK_VERBOSE") else logging.WARNING)
+
+# Encoded payloads are bytes; they go out with send(..., text=True) because
+# CodexPilot only reads text frames.
+try:
+    from orjson import dumps as _dumps, loads as _loads
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+# Single clock sample the fixture timestamps are offset from
+_T0 = int(time.time())
+
 MOCK_THREADS = [
     {
         "id": "thread-001-abc",
@@ -28,8 +49,8 @@ MOCK_THREADS = [
         "cwd": "/Users/dev/myproject",
         "archived": False,
         "modelProvider": "openai",
-        "createdAt": int(time.time()) - 3600,
-        "updatedAt": int(time.time()) - 1800,
+        "createdAt": _T0 - 3600,
+        "updatedAt": _T0 - 1800,
         "status": {"type": "idle"},
         "preview": "Fix the login bug",
         "cliVersion": "0.1.0",
@@ -41,8 +62,8 @@ MOCK_THREADS = [
         "cwd": "/Users/dev/parser",
         "archived": False,
         "modelProvider": "openai",
-        "createdAt": int(time.time()) - 7200,
-        "updatedAt": int(time.time()) - 3600,
+        "createdAt": _T0 - 7200,
+        "updatedAt": _T0 - 3600,
         "status": {"type": "idle"},
         "preview": "Write tests",
         "cliVersion": "0.1.0",
@@ -54,8 +75,8 @@ MOCK_THREADS = [
         "cwd": "/Users/dev/database",
         "archived": False,
         "modelProvider": "anthropic",
-        "createdAt": int(time.time()) - 86400,
-        "updatedAt": int(time.time()) - 43200,
+        "createdAt": _T0 - 86400,
+        "updatedAt": _T0 - 43200,
         "status": {"type": "idle"},
         "preview": "Refactor DB",
         "cliVersion": "0.1.0",
@@ -70,8 +91,8 @@ ARCHIVED_THREADS = [
         "cwd": "/Users/dev/migrations",
         "archived": True,
         "modelProvider": "openai",
-        "createdAt": int(time.time()) - 172800,
-        "updatedAt": int(time.time()) - 172800,
+        "createdAt": _T0 - 172800,
+        "updatedAt": _T0 - 172800,
         "status": {"type": "notLoaded"},
         "preview": "DB migration",
         "cliVersion": "0.1.0",
@@ -79,7 +100,10 @@ ARCHIVED_THREADS = [
     },
 ]
 
-LOADED_THREAD_IDS = ["thread-001-abc", "thread-002-def"]
+# Active and archived threads by id; entries survive archive/unarchive
+THREADS_BY_ID = {t["id"]: t for t in MOCK_THREADS + ARCHIVED_THREADS}
+
+LOADED_THREAD_IDS = {"thread-001-abc", "thread-002-def"}
 
 MOCK_TURNS = {
     "thread-001-abc": [
@@ -107,345 +131,496 @@ MOCK_TURNS = {
     "thread-003-ghi": [],
 }
 
-# Rate limit state
-rate_limit_used = 35
-rate_limit_window_mins = 300
-rate_limit_resets_at = int(time.time()) + 10800
+# Words coalesced into each item/agentMessage/delta notification
+DELTA_BATCH_WORDS = 4
+
+# Canned agent reply streamed by every simulated turn
+RESPONSE_TEXT = "I'll help you with that. Let me analyze the code and make the necessary changes."
+COMMAND = "grep -r 'TODO' src/"
+COMMAND_OUTPUT = "src/main.ts:15: // TODO: refactor this\nsrc/utils.ts:8: // TODO: add validation"
+
+# Outgoing messages buffered per connection. The receive loop waits for room;
+# a turn worker that finds the queue full drops the client.
+OUT_QUEUE_SIZE = 1024
+
+# Seconds a closing session waits for already-queued frames to go out
+FLUSH_TIMEOUT = 2.0
+
+# Per-connection turn backlog and the number of turns simulated concurrently
+TURN_QUEUE_SIZE = 16
+TURN_WORKERS = 2
+
+# Pre-serialized response bodies. Only the JSON-encoded id (and, for rate
+# limits, the live counters) are spliced in per request.
+_INIT_TMPL = b'{"id":%s,"result":{"userAgent":"codex-app-server/0.1.0-mock"}}'
+_ACCOUNT_TMPL = b'{"id":%s,"result":' + _dumps({
+    "account": {
+        "type": "chatgpt",
+        "email": "dev@example.com",
+        "planType": "pro",
+    },
+    "requiresOpenaiAuth": False,
+}) + b'}'
+_RATE_LIMITS_TMPL = (
+    b'{"id":%s,"result":{"rateLimits":{"limitId":"limit-001","limitName":"codex-pro",'
+    b'"primary":{"usedPercent":%d,"windowDurationMins":%d,"resetsAt":%d},'
+    b'"secondary":null,'
+    b'"credits":{"hasCredits":true,"unlimited":false,"balance":"$42.50"},'
+    b'"planType":"pro"},"rateLimitsByLimitId":null}}'
+)
+_LIST_TMPL = b'{"id":%s,"result":{"data":%s,"nextCursor":null}}'
+_INVALID_REQUEST = b'{"id":null,"error":{"code":-32600,"message":"Invalid Request"}}'
+
+# Notification templates; %s takes the JSON-encoded threadId.
+_TURN_STARTED_TMPL = b'{"method":"turn/started","params":{"threadId":%s}}'
+_TURN_COMPLETED_TMPL = b'{"method":"turn/completed","params":{"threadId":%s}}'
+_STATUS_ACTIVE_TMPL = (
+    b'{"method":"thread/status/changed","params":{"threadId":%s,'
+    b'"status":{"type":"active","activeFlags":[]}}}'
+)
+_STATUS_IDLE_TMPL = b'{"method":"thread/status/changed","params":{"threadId":%s,"status":{"type":"idle"}}}'
+_TOKEN_USAGE_TMPL = (
+    b'{"method":"thread/tokenUsage/updated","params":{"threadId":%s,'
+    b'"tokenUsage":{"total":{"totalTokens":%d}}}}'
+)
+_RATE_LIMITS_UPDATED_TMPL = (
+    b'{"method":"account/rateLimits/updated","params":{"rateLimits":{'
+    b'"limitId":"limit-001","limitName":"codex-pro",'
+    b'"primary":{"usedPercent":%d,"windowDurationMins":%d,"resetsAt":%d},'
+    b'"planType":"pro"}}}'
+)
+_DELTA_TMPL = b'{"method":"item/agentMessage/delta","params":{"threadId":%s,"itemId":%s,"delta":%s}}'
+
+# Item templates take the encoded threadId, turnId and item id, in that order.
+_AGENT_STARTED_TMPL = (
+    b'{"method":"item/started","params":{"threadId":%s,"turnId":%s,'
+    b'"item":{"id":%s,"type":"agentMessage","text":""}}}'
+)
+_AGENT_COMPLETED_TMPL = (
+    b'{"method":"item/completed","params":{"threadId":%s,"turnId":%s,'
+    b'"item":{"id":%s,"type":"agentMessage","text":' + _dumps(RESPONSE_TEXT) + b'}}}'
+)
+_COMMAND_STARTED_TMPL = (
+    b'{"method":"item/started","params":{"threadId":%s,"turnId":%s,'
+    b'"item":{"id":%s,"type":"commandExecution","command":' + _dumps(COMMAND) + b',"status":"inProgress"}}}'
+)
+_COMMAND_COMPLETED_TMPL = (
+    b'{"method":"item/completed","params":{"threadId":%s,"turnId":%s,'
+    b'"item":{"id":%s,"type":"commandExecution","command":' + _dumps(COMMAND) + b','
+    b'"status":"completed","exitCode":0,"aggregatedOutput":' + _dumps(COMMAND_OUTPUT) + b'}}}'
+)
+# Server -> client request; takes the request id and encoded threadId
+_APPROVAL_TMPL = (
+    b'{"id":%d,"method":"commandExecution/requestApproval",'
+    b'"params":{"threadId":%s,"command":{"command":' + _dumps(COMMAND) + b'}}}'
+)
+
+
+def _split_deltas(text, batch_words):
+    """Split text into (encoded delta, word count) pairs of batch_words words."""
+    words = text.split(" ")
+    deltas = []
+    for i in range(0, len(words), batch_words):
+        batch = words[i:i + batch_words]
+        delta = " ".join(batch) + (" " if i + batch_words < len(words) else "")
+        deltas.append((_dumps(delta), len(batch)))
+    return tuple(deltas)
+
+
+# RESPONSE_TEXT pre-split into the deltas simulate_turn streams
+_DELTAS = _split_deltas(RESPONSE_TEXT, DELTA_BATCH_WORDS)
+
+# Bumped whenever LOADED_THREAD_IDS changes; the encoded list is rebuilt lazily.
+_loaded_version = 0
+_loaded_cache = (-1, b"[]")
+
+
+def _loaded_data():
+    global _loaded_cache
+    version, data = _loaded_cache
+    if version != _loaded_version:
+        data = _dumps([{"id": tid} for tid in LOADED_THREAD_IDS])
+        _loaded_cache = (_loaded_version, data)
+    return data
+
+
+# Encoded thread objects by id; an entry is dropped whenever its thread changes.
+_THREAD_JSON = {}
+
+
+def _thread_json(thread):
+    data = _THREAD_JSON.get(thread["id"])
+    if data is None:
+        data = _THREAD_JSON[thread["id"]] = _dumps(thread)
+    return data
+
+
+@dataclass
+class ClientState:
+    """Per-connection queues and rate limit state, shared by the handlers and turn workers."""
+    out: asyncio.Queue
+    turns: asyncio.Queue
+    rate_limit_used: int = 35
+    rate_limit_window_mins: int = 300
+    rate_limit_resets_at: int = field(default_factory=lambda: int(time.time()) + 10800)
+    # Cleared by initialize capabilities.statusNotifications=false (load tests)
+    wants_status_changes: bool = True
+
+
+def _h_initialize(client, msg_id, params, reply, notify):
+    capabilities = (params or {}).get("capabilities")
+    if isinstance(capabilities, dict):
+        client.wants_status_changes = capabilities.get("statusNotifications") is not False
+    reply(_INIT_TMPL % _dumps(msg_id))
+    _LOG.info("  -> initialize response")
+
+
+def _h_thread_list(client, msg_id, params, reply, notify):
+    show_archived = params.get("showArchived", False)
+    threads = MOCK_THREADS + ARCHIVED_THREADS if show_archived else MOCK_THREADS
+    data = b"[" + b",".join(map(_thread_json, threads)) + b"]"
+    reply(_LIST_TMPL % (_dumps(msg_id), data))
+    _LOG.info("  -> %d threads (showArchived=%s)", len(threads), show_archived)
+
+
+def _h_thread_loaded_list(client, msg_id, params, reply, notify):
+    reply(_LIST_TMPL % (_dumps(msg_id), _loaded_data()))
+    _LOG.info("  -> %d loaded threads", len(LOADED_THREAD_IDS))
+
+
+def _h_thread_start(client, msg_id, params, reply, notify):
+    global _loaded_version
+    new_id = f"thread-{secrets.token_hex(4)}"
+    now = int(time.time())
+    new_thread = {
+        "id": new_id,
+        "name": None,
+        "cwd": "/Users/dev/workspace",
+        "archived": False,
+        "modelProvider": "openai",
+        "createdAt": now,
+        "updatedAt": now,
+        "status": {"type": "idle"},
+        "preview": "",
+        "cliVersion": "0.1.0",
+        "source": "appServer",
+        "turns": [],
+    }
+    MOCK_THREADS.insert(0, new_thread)
+    THREADS_BY_ID[new_id] = new_thread
+    LOADED_THREAD_IDS.add(new_id)
+    _loaded_version += 1
+    MOCK_TURNS[new_id] = []
+    resp = {
+        "id": msg_id,
+        "result": {
+            "thread": new_thread,
+            "model": "o4-mini",
+            "modelProvider": "openai",
+            "cwd": "/Users/dev/workspace",
+            "approvalPolicy": "auto-edit",
+            "sandbox": {"type": "dangerFullAccess"},
+        }
+    }
+    reply(_dumps(resp))
+    # Send thread/started notification
+    notif = {"method": "thread/started", "params": {"thread": new_thread}}
+    notify(_dumps(notif))
+    _LOG.info("  -> created new thread %s", new_id)
+
+
+def _h_thread_resume(client, msg_id, params, reply, notify):
+    global _loaded_version
+    thread_id = params.get("threadId", "")
+    thread = THREADS_BY_ID.get(thread_id)
+    turns = MOCK_TURNS.get(thread_id, [])
+    resp = {
+        "id": msg_id,
+        "result": {
+            "thread": {
+                "id": thread_id,
+                "name": thread["name"] if thread else "Unknown",
+                "turns": turns,
+            },
+            "modelProvider": thread.get("modelProvider", "openai") if thread else "openai",
+        }
+    }
+    reply(_dumps(resp))
+    if thread_id not in LOADED_THREAD_IDS:
+        LOADED_THREAD_IDS.add(thread_id)
+        _loaded_version += 1
+    _LOG.info("  -> resumed %s (%d turns)", thread_id, len(turns))
+
+
+def _h_thread_archive(client, msg_id, params, reply, notify):
+    thread_id = params.get("threadId", "?")
+    thread = THREADS_BY_ID.get(thread_id)
+    if thread and not thread["archived"]:
+        MOCK_THREADS.remove(thread)
+        thread["archived"] = True
+        ARCHIVED_THREADS.append(thread)
+        _THREAD_JSON.pop(thread_id, None)
+    resp = {"id": msg_id, "result": {}}
+    reply(_dumps(resp))
+    notif = {"method": "thread/archived", "params": {"threadId": thread_id}}
+    notify(_dumps(notif))
+    _LOG.info("  -> archived %s", thread_id)
+
+
+def _h_thread_unarchive(client, msg_id, params, reply, notify):
+    thread_id = params.get("threadId", "?")
+    thread = THREADS_BY_ID.get(thread_id)
+    if thread and thread["archived"]:
+        ARCHIVED_THREADS.remove(thread)
+        thread["archived"] = False
+        MOCK_THREADS.append(thread)
+        _THREAD_JSON.pop(thread_id, None)
+    else:
+        thread = None
+    resp = {
+        "id": msg_id,
+        "result": {"thread": thread} if thread else {}
+    }
+    reply(_dumps(resp))
+    notif = {"method": "thread/unarchived", "params": {"threadId": thread_id}}
+    notify(_dumps(notif))
+    _LOG.info("  -> unarchived %s", thread_id)
 
 
-async def handle_client(websocket):
-    global rate_limit_used
-    print(f"[+] Client connected from {websocket.remote_address}")
+def _h_thread_name_set(client, msg_id, params, reply, notify):
+    thread_id = params.get("threadId", "?")
+    new_name = params.get("name", "Unnamed")
+    thread = THREADS_BY_ID.get(thread_id)
+    if thread:
+        thread["name"] = new_name
+        _THREAD_JSON.pop(thread_id, None)
+    resp = {"id": msg_id, "result": {}}
+    reply(_dumps(resp))
+    notif = {"method": "thread/name/updated", "params": {"threadId": thread_id, "threadName": new_name}}
+    notify(_dumps(notif))
+    _LOG.info("  -> renamed %s to '%s'", thread_id, new_name)
+
+
+def _h_account_read(client, msg_id, params, reply, notify):
+    reply(_ACCOUNT_TMPL % _dumps(msg_id))
+    _LOG.info("  -> account info (pro)")
+
+
+def _h_account_rate_limits_read(client, msg_id, params, reply, notify):
+    reply(_RATE_LIMITS_TMPL % (
+        _dumps(msg_id), client.rate_limit_used, client.rate_limit_window_mins, client.rate_limit_resets_at
+    ))
+    _LOG.info("  -> rate limits (%d%% used)", client.rate_limit_used)
+
+
+def _h_turn_start(client, msg_id, params, reply, notify):
+    thread_id = params.get("threadId", "")
     try:
-        async for raw in websocket:
-            msg = json.loads(raw)
-            method = msg.get("method", "")
-            msg_id = msg.get("id")
-            params = msg.get("params", {})
-            print(f"  <- {method} (id={msg_id})")
-
-            if method == "initialize":
-                resp = {"id": msg_id, "result": {"userAgent": "codex-app-server/0.1.0-mock"}}
-                await websocket.send(json.dumps(resp))
-                print(f"  -> initialize response")
-
-            elif method == "thread/list":
-                show_archived = params.get("showArchived", False)
-                threads = list(MOCK_THREADS)
-                if show_archived:
-                    threads.extend(ARCHIVED_THREADS)
-                resp = {"id": msg_id, "result": {"data": threads, "nextCursor": None}}
-                await websocket.send(json.dumps(resp))
-                print(f"  -> {len(threads)} threads (showArchived={show_archived})")
-
-            elif method == "thread/loaded/list":
-                loaded = [{"id": tid} for tid in LOADED_THREAD_IDS]
-                resp = {"id": msg_id, "result": {"data": loaded, "nextCursor": None}}
-                await websocket.send(json.dumps(resp))
-                print(f"  -> {len(LOADED_THREAD_IDS)} loaded threads")
-
-            elif method == "thread/start":
-                new_id = f"thread-{uuid.uuid4().hex[:8]}"
-                new_thread = {
-                    "id": new_id,
-                    "name": None,
-                    "cwd": "/Users/dev/workspace",
-                    "archived": False,
-                    "modelProvider": "openai",
-                    "createdAt": int(time.time()),
-                    "updatedAt": int(time.time()),
-                    "status": {"type": "idle"},
-                    "preview": "",
-                    "cliVersion": "0.1.0",
-                    "source": "appServer",
-                    "turns": [],
-                }
-                MOCK_THREADS.insert(0, new_thread)
-                LOADED_THREAD_IDS.append(new_id)
-                MOCK_TURNS[new_id] = []
-                resp = {
-                    "id": msg_id,
-                    "result": {
-                        "thread": new_thread,
-                        "model": "o4-mini",
-                        "modelProvider": "openai",
-                        "cwd": "/Users/dev/workspace",
-                        "approvalPolicy": "auto-edit",
-                        "sandbox": {"type": "dangerFullAccess"},
-                    }
-                }
-                await websocket.send(json.dumps(resp))
-                # Send thread/started notification
-                notif = {"method": "thread/started", "params": {"thread": new_thread}}
-                await websocket.send(json.dumps(notif))
-                print(f"  -> created new thread {new_id}")
-
-            elif method == "thread/resume":
-                thread_id = params.get("threadId", "")
-                thread = next((t for t in MOCK_THREADS if t["id"] == thread_id), None)
-                turns = MOCK_TURNS.get(thread_id, [])
-                resp = {
-                    "id": msg_id,
-                    "result": {
-                        "thread": {
-                            "id": thread_id,
-                            "name": thread["name"] if thread else "Unknown",
-                            "turns": turns,
-                        },
-                        "modelProvider": thread.get("modelProvider", "openai") if thread else "openai",
-                    }
-                }
-                await websocket.send(json.dumps(resp))
-                if thread_id not in LOADED_THREAD_IDS:
-                    LOADED_THREAD_IDS.append(thread_id)
-                print(f"  -> resumed {thread_id} ({len(turns)} turns)")
-
-            elif method == "thread/archive":
-                thread_id = params.get("threadId", "?")
-                thread = next((t for t in MOCK_THREADS if t["id"] == thread_id), None)
-                if thread:
-                    MOCK_THREADS.remove(thread)
-                    thread["archived"] = True
-                    ARCHIVED_THREADS.append(thread)
-                resp = {"id": msg_id, "result": {}}
-                await websocket.send(json.dumps(resp))
-                notif = {"method": "thread/archived", "params": {"threadId": thread_id}}
-                await websocket.send(json.dumps(notif))
-                print(f"  -> archived {thread_id}")
-
-            elif method == "thread/unarchive":
-                thread_id = params.get("threadId", "?")
-                thread = next((t for t in ARCHIVED_THREADS if t["id"] == thread_id), None)
-                if thread:
-                    ARCHIVED_THREADS.remove(thread)
-                    thread["archived"] = False
-                    MOCK_THREADS.append(thread)
-                resp = {
-                    "id": msg_id,
-                    "result": {"thread": thread} if thread else {}
-                }
-                await websocket.send(json.dumps(resp))
-                notif = {"method": "thread/unarchived", "params": {"threadId": thread_id}}
-                await websocket.send(json.dumps(notif))
-                print(f"  -> unarchived {thread_id}")
-
-            elif method == "thread/name/set":
-                thread_id = params.get("threadId", "?")
-                new_name = params.get("name", "Unnamed")
-                for t in MOCK_THREADS:
-                    if t["id"] == thread_id:
-                        t["name"] = new_name
-                resp = {"id": msg_id, "result": {}}
-                await websocket.send(json.dumps(resp))
-                notif = {"method": "thread/name/updated", "params": {"threadId": thread_id, "threadName": new_name}}
-                await websocket.send(json.dumps(notif))
-                print(f"  -> renamed {thread_id} to '{new_name}'")
-
-            elif method == "account/read":
-                resp = {
-                    "id": msg_id,
-                    "result": {
-                        "account": {
-                            "type": "chatgpt",
-                            "email": "dev@example.com",
-                            "planType": "pro",
-                        },
-                        "requiresOpenaiAuth": False,
-                    }
-                }
-                await websocket.send(json.dumps(resp))
-                print(f"  -> account info (pro)")
-
-            elif method == "account/rateLimits/read":
-                resp = {
-                    "id": msg_id,
-                    "result": {
-                        "rateLimits": {
-                            "limitId": "limit-001",
-                            "limitName": "codex-pro",
-                            "primary": {
-                                "usedPercent": rate_limit_used,
-                                "windowDurationMins": rate_limit_window_mins,
-                                "resetsAt": rate_limit_resets_at,
-                            },
-                            "secondary": None,
-                            "credits": {
-                                "hasCredits": True,
-                                "unlimited": False,
-                                "balance": "$42.50",
-                            },
-                            "planType": "pro",
-                        },
-                        "rateLimitsByLimitId": None,
-                    }
-                }
-                await websocket.send(json.dumps(resp))
-                print(f"  -> rate limits ({rate_limit_used}% used)")
-
-            elif method == "turn/start":
-                thread_id = params.get("threadId", "")
-                resp = {"id": msg_id, "result": {}}
-                await websocket.send(json.dumps(resp))
-                print(f"  -> turn/start ack")
-                asyncio.create_task(simulate_turn(websocket, thread_id, params.get("input", [])))
-
-            elif method == "turn/interrupt":
-                resp = {"id": msg_id, "result": {}}
-                await websocket.send(json.dumps(resp))
-                notif = {"method": "turn/completed", "params": {"threadId": params.get("threadId")}}
-                await websocket.send(json.dumps(notif))
-                print(f"  -> interrupted")
+        client.turns.put_nowait((thread_id, params.get("input", [])))
+    except asyncio.QueueFull:
+        resp = {"id": msg_id, "error": {"code": -32000, "message": "Too many queued turns"}}
+        reply(_dumps(resp))
+        _LOG.info("  -> turn/start rejected (queue full)")
+        return
+    resp = {"id": msg_id, "result": {}}
+    reply(_dumps(resp))
+    _LOG.info("  -> turn/start ack")
+
+
+def _h_turn_interrupt(client, msg_id, params, reply, notify):
+    resp = {"id": msg_id, "result": {}}
+    reply(_dumps(resp))
+    notify(_TURN_COMPLETED_TMPL % _dumps(params.get("threadId")))
+    _LOG.info("  -> interrupted")
+
+
+# JSON-RPC method -> handler; anything else gets an empty result
+HANDLERS = {
+    "initialize": _h_initialize,
+    "thread/list": _h_thread_list,
+    "thread/loaded/list": _h_thread_loaded_list,
+    "thread/start": _h_thread_start,
+    "thread/resume": _h_thread_resume,
+    "thread/archive": _h_thread_archive,
+    "thread/unarchive": _h_thread_unarchive,
+    "thread/name/set": _h_thread_name_set,
+    "account/read": _h_account_read,
+    "account/rateLimits/read": _h_account_rate_limits_read,
+    "turn/start": _h_turn_start,
+    "turn/interrupt": _h_turn_interrupt,
+}
 
-            else:
-                resp = {"id": msg_id, "result": {}}
-                await websocket.send(json.dumps(resp))
-                print(f"  -> empty result for {method}")
 
+async def _writer(websocket, out):
+    """Drain a connection's outgoing queue onto the socket, in order."""
+    send, get, done = websocket.send, out.get, out.task_done
+    while True:
+        await send(await get(), text=True)
+        done()
+
+
+def _drop(data):
+    pass
+
+
+def _handle_one(client, msg, reply, notify):
+    """Dispatch one JSON-RPC message; its response goes to reply(), notifications to notify()."""
+    if not isinstance(msg, dict):
+        reply(_INVALID_REQUEST)
+        _LOG.info("  -> invalid request %r", msg)
+        return
+    method = msg.get("method", "")
+    msg_id = msg.get("id")
+    params = msg.get("params", {})
+    _LOG.info("  <- %s (id=%s)", method, msg_id)
+    if "id" not in msg:
+        # Notifications never get a response, batched or not
+        reply = _drop
+
+    # Non-string methods (unhashable or not) fall through to the empty result
+    handler = HANDLERS.get(method) if isinstance(method, str) else None
+    if handler is not None:
+        handler(client, msg_id, params, reply, notify)
+    elif reply is _drop:
+        _LOG.info("  -> no response to notification %s", method)
+    else:
+        resp = {"id": msg_id, "result": {}}
+        reply(_dumps(resp))
+        _LOG.info("  -> empty result for %s", method)
+
+
+async def _turn_worker(websocket, client):
+    """Run queued turns for one connection, one at a time."""
+    # A failed turn ends the session; a silently dead worker would leave
+    # turn/start acking turns that never run.
+    try:
+        while True:
+            thread_id, input_items = await client.turns.get()
+            await simulate_turn(client, thread_id, input_items)
+    except asyncio.QueueFull:
+        _LOG.warning("[-] Client dropped: fell %d messages behind", OUT_QUEUE_SIZE)
     except Exception as e:
-        print(f"[-] Client disconnected: {e}")
+        _LOG.warning("[-] Turn failed, closing connection: %r", e)
+    await websocket.close()
+
 
+async def handle_client(websocket):
+    _LOG.info("[+] Client connected from %s", websocket.remote_address)
+    client = ClientState(
+        out=asyncio.Queue(maxsize=OUT_QUEUE_SIZE),
+        turns=asyncio.Queue(maxsize=TURN_QUEUE_SIZE),
+    )
+    writer = asyncio.create_task(_writer(websocket, client.out))
+    workers = [asyncio.create_task(_turn_worker(websocket, client)) for _ in range(TURN_WORKERS)]
+    # Hot loop: bind lookups to locals once. Frames produced for one inbound
+    # message are collected in pending, then queued with put() so a pipelining
+    # client waits for the writer instead of overflowing the queue.
+    pending = []
+    emit = pending.append
+    put = client.out.put
+    loads = _loads
+    handle_one = _handle_one
+    try:
+        async for raw in websocket:
+            msg = loads(raw)
+            if isinstance(msg, list):
+                # JSON-RPC batch: one array frame holds the responses, and the
+                # notifications they trigger follow it, as for single requests.
+                if not msg:
+                    emit(_INVALID_REQUEST)
+                else:
+                    responses = []
+                    for entry in msg:
+                        handle_one(client, entry, responses.append, emit)
+                    if responses:
+                        pending.insert(0, b"[" + b",".join(responses) + b"]")
+            else:
+                handle_one(client, msg, emit, emit)
+            for data in pending:
+                await put(data)
+            pending.clear()
 
-async def simulate_turn(ws, thread_id, input_items):
+    except Exception as e:
+        _LOG.warning("[-] Client disconnected: %s", e)
+    finally:
+        for task in workers:
+            task.cancel()
+        # Flush what is already queued; the writer stops by itself if the
+        # socket is gone.
+        drained = asyncio.ensure_future(client.out.join())
+        await asyncio.wait([drained, writer], timeout=FLUSH_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+        drained.cancel()
+        writer.cancel()
+
+
+async def simulate_turn(client, thread_id, input_items):
     """Simulate a full turn with streaming agent response."""
-    global rate_limit_used
+    send = client.out.put_nowait
+    tid = _dumps(thread_id)
     await asyncio.sleep(0.3)
 
     # Send turn/started
-    notif = {"method": "turn/started", "params": {"threadId": thread_id}}
-    await ws.send(json.dumps(notif))
-    print(f"  ~> turn/started")
+    send(_TURN_STARTED_TMPL % tid)
+    _LOG.info("  ~> turn/started")
 
     # Status change to active
-    status_notif = {"method": "thread/status/changed", "params": {"threadId": thread_id, "status": {"type": "active", "activeFlags": []}}}
-    await ws.send(json.dumps(status_notif))
+    if client.wants_status_changes:
+        send(_STATUS_ACTIVE_TMPL % tid)
 
     await asyncio.sleep(0.5)
 
     # Send item/started for agent message
-    agent_item_id = f"agent-{uuid.uuid4().hex[:8]}"
-    turn_id = f"turn-{uuid.uuid4().hex[:8]}"
-    item_started = {
-        "method": "item/started",
-        "params": {
-            "threadId": thread_id,
-            "turnId": turn_id,
-            "item": {"id": agent_item_id, "type": "agentMessage", "text": ""},
-        }
-    }
-    await ws.send(json.dumps(item_started))
-    print(f"  ~> item/started (agentMessage)")
-
-    # Stream deltas
-    response_text = "I'll help you with that. Let me analyze the code and make the necessary changes."
-    words = response_text.split(" ")
-    for i, word in enumerate(words):
-        delta = word + (" " if i < len(words) - 1 else "")
-        delta_notif = {
-            "method": "item/agentMessage/delta",
-            "params": {"threadId": thread_id, "itemId": agent_item_id, "delta": delta}
-        }
-        await ws.send(json.dumps(delta_notif))
-        await asyncio.sleep(0.08)
+    agent_item_id = _dumps(f"agent-{secrets.token_hex(4)}")
+    turn_id = _dumps(f"turn-{secrets.token_hex(4)}")
+    send(_AGENT_STARTED_TMPL % (tid, turn_id, agent_item_id))
+    _LOG.info("  ~> item/started (agentMessage)")
+
+    # Stream deltas, pausing between batches
+    *head, (last_delta, last_words) = _DELTAS
+    for delta, n_words in head:
+        send(_DELTA_TMPL % (tid, agent_item_id, delta))
+        await asyncio.sleep(0.08 * n_words)
+    send(_DELTA_TMPL % (tid, agent_item_id, last_delta))
 
     # Complete the agent message item
-    item_completed = {
-        "method": "item/completed",
-        "params": {
-            "threadId": thread_id,
-            "turnId": turn_id,
-            "item": {"id": agent_item_id, "type": "agentMessage", "text": response_text},
-        }
-    }
-    await ws.send(json.dumps(item_completed))
+    send(_AGENT_COMPLETED_TMPL % (tid, turn_id, agent_item_id))
 
-    await asyncio.sleep(0.3)
+    # The last batch's pause and the pre-approval pause share one timer
+    await asyncio.sleep(0.08 * last_words + 0.3)
 
     # Simulate a command execution with approval request
-    approval_req = {
-        "id": random.randint(1000, 9999),
-        "method": "commandExecution/requestApproval",
-        "params": {
-            "threadId": thread_id,
-            "command": {"command": "grep -r 'TODO' src/"},
-        }
-    }
-    await ws.send(json.dumps(approval_req))
-    print(f"  ~> commandExecution/requestApproval (id={approval_req['id']})")
+    approval_id = random.randint(1000, 9999)
+    send(_APPROVAL_TMPL % (approval_id, tid))
+    _LOG.info("  ~> commandExecution/requestApproval (id=%d)", approval_id)
 
     await asyncio.sleep(1.0)
 
     # Command item started
-    cmd_item_id = f"cmd-{uuid.uuid4().hex[:8]}"
-    cmd_started = {
-        "method": "item/started",
-        "params": {
-            "threadId": thread_id,
-            "turnId": turn_id,
-            "item": {"id": cmd_item_id, "type": "commandExecution", "command": "grep -r 'TODO' src/", "status": "inProgress"},
-        }
-    }
-    await ws.send(json.dumps(cmd_started))
+    cmd_item_id = _dumps(f"cmd-{secrets.token_hex(4)}")
+    send(_COMMAND_STARTED_TMPL % (tid, turn_id, cmd_item_id))
 
     await asyncio.sleep(0.5)
 
     # Command completed
-    cmd_completed = {
-        "method": "item/completed",
-        "params": {
-            "threadId": thread_id,
-            "turnId": turn_id,
-            "item": {
-                "id": cmd_item_id,
-                "type": "commandExecution",
-                "command": "grep -r 'TODO' src/",
-                "status": "completed",
-                "exitCode": 0,
-                "aggregatedOutput": "src/main.ts:15: // TODO: refactor this\nsrc/utils.ts:8: // TODO: add validation",
-            },
-        }
-    }
-    await ws.send(json.dumps(cmd_completed))
+    send(_COMMAND_COMPLETED_TMPL % (tid, turn_id, cmd_item_id))
 
     await asyncio.sleep(0.3)
 
     # Update rate limit usage
-    rate_limit_used = min(100, rate_limit_used + random.randint(2, 7))
-    rate_notif = {
-        "method": "account/rateLimits/updated",
-        "params": {
-            "rateLimits": {
-                "limitId": "limit-001",
-                "limitName": "codex-pro",
-                "primary": {
-                    "usedPercent": rate_limit_used,
-                    "windowDurationMins": rate_limit_window_mins,
-                    "resetsAt": rate_limit_resets_at,
-                },
-                "planType": "pro",
-            }
-        }
-    }
-    await ws.send(json.dumps(rate_notif))
-    print(f"  ~> rate limit updated: {rate_limit_used}%")
+    used = client.rate_limit_used = min(100, client.rate_limit_used + random.randint(2, 7))
+    send(_RATE_LIMITS_UPDATED_TMPL % (used, client.rate_limit_window_mins, client.rate_limit_resets_at))
+    _LOG.info("  ~> rate limit updated: %d%%", used)
 
     # Token usage update
-    usage_notif = {
-        "method": "thread/tokenUsage/updated",
-        "params": {
-            "threadId": thread_id,
-            "tokenUsage": {"total": {"totalTokens": random.randint(1000, 5000)}}
-        }
-    }
-    await ws.send(json.dumps(usage_notif))
+    send(_TOKEN_USAGE_TMPL % (tid, random.randint(1000, 5000)))
 
     # Turn completed
-    done_notif = {"method": "turn/completed", "params": {"threadId": thread_id}}
-    await ws.send(json.dumps(done_notif))
+    send(_TURN_COMPLETED_TMPL % tid)
 
     # Status back to idle
-    status_notif = {"method": "thread/status/changed", "params": {"threadId": thread_id, "status": {"type": "idle"}}}
-    await ws.send(json.dumps(status_notif))
-    print(f"  ~> turn/completed")
+    if client.wants_status_changes:
+        send(_STATUS_IDLE_TMPL % tid)
+    _LOG.info("  ~> turn/completed")
 
 
 async def main():
@@ -454,9 +629,25 @@ async def main():
     print("          thread/start, thread/archive, thread/unarchive, thread/name/set,")
     print("          account/read, account/rateLimits/read, turn/start (streaming),")
     print("          turn/interrupt + account/rateLimits/updated notifications")
+    print("Set MOCK_VERBOSE=1 to log every message")
     print("Press Ctrl+C to stop\n")
-    server = await websockets.serve(handle_client, "127.0.0.1", 8080, compression=None)
+    server = await websockets.serve(
+        handle_client, "127.0.0.1", 8080,
+        compression=None,
+        max_size=1 << 20,
+        max_queue=64,
+        # Let up to 1 MiB of streamed frames buffer before send() waits on drain
+        write_limit=1 << 20,
+        # Local loopback mock: keepalive pings are just extra frames
+        ping_interval=None,
+    )
     await asyncio.Future()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    logging.basicConfig(format="%(message)s")
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())